@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
+import ast
+import copy
 import logging
 import warnings
 
@@ -7,9 +9,103 @@ from odoo import api, fields, models, tools, SUPERUSER_ID, _
 from odoo.exceptions import AccessError, ValidationError
 from odoo.osv import expression
 from odoo.tools import config
-from odoo.tools.safe_eval import safe_eval, time
+from odoo.tools.safe_eval import safe_eval_cached, time
 
 _logger = logging.getLogger(__name__)
+
+# queries returning the rules of a model for a mode, keyed by (su, mode): the
+# superuser only gets the global rules, while other users also get the rules
+# of their groups
+_GLOBAL_RULES_SQL = """ SELECT r.id FROM ir_rule r JOIN ir_model m ON (r.model_id=m.id)
+                        WHERE m.model=%(model)s AND r.active AND r.perm_{mode} AND r.global
+                    """
+_GROUP_RULES_SQL = """ SELECT r.id FROM ir_rule r JOIN ir_model m ON (r.model_id=m.id)
+                       JOIN rule_group_rel rg ON (rg.rule_group_id=r.id)
+                       JOIN res_groups_users_rel gu ON (gu.gid=rg.group_id AND gu.uid=%(uid)s)
+                       WHERE m.model=%(model)s AND r.active AND r.perm_{mode}
+                   """
+_RULES_SQL = {
+    (su, mode): (
+        _GLOBAL_RULES_SQL.format(mode=mode) if su else
+        _GLOBAL_RULES_SQL.format(mode=mode) + " UNION " + _GROUP_RULES_SQL.format(mode=mode)
+    ) + " ORDER BY id"
+    for su in (True, False)
+    for mode in ('read', 'write', 'create', 'unlink')
+}
+
+
+# names of the evaluation context that domains evaluated without safe_eval
+# may refer to, besides constants
+_FAST_DOMAIN_NAMES = frozenset(['company_id', 'company_ids', 'user.id', 'user.partner_id.id'])
+
+
+def _dotted_name(node):
+    """ Return the dotted name of an AST node like ``user.partner_id.id``, or
+    ``None`` if the node is not made of names and attributes only.
+    """
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        prefix = _dotted_name(node.value)
+        return prefix and prefix + '.' + node.attr
+    return None
+
+
+def _parse_fast_domain(domain_force):
+    """ Return a template of the domain ``domain_force`` as a list of pairs
+    ``(value, name)``: the element of the domain is either the constant
+    ``value``, or the leaf made of ``value`` followed by ``<name>``, which is
+    one of ``_FAST_DOMAIN_NAMES``. Return ``None`` if the domain has another shape.
+    """
+    try:
+        node = ast.parse(domain_force.strip(), mode='eval').body
+    except SyntaxError:
+        return None
+    if not isinstance(node, ast.List):
+        return None
+    template = []
+    for elt in node.elts:
+        try:
+            template.append((ast.literal_eval(elt), None))
+            continue
+        except (ValueError, TypeError):
+            pass
+        if not (isinstance(elt, (ast.Tuple, ast.List)) and len(elt.elts) == 3):
+            return None
+        name = _dotted_name(elt.elts[2])
+        if name not in _FAST_DOMAIN_NAMES:
+            return None
+        try:
+            prefix = [ast.literal_eval(elt.elts[0]), ast.literal_eval(elt.elts[1])]
+        except (ValueError, TypeError):
+            return None
+        # keep the leaf as a list or a tuple, like the evaluation would
+        template.append((prefix if isinstance(elt, ast.List) else tuple(prefix), name))
+    return template
+
+
+def _AND(domains):
+    """ Same as :func:`~odoo.osv.expression.AND` for normalized domains, but
+    returns the domain itself when there is only one.
+    """
+    if not domains:
+        return [expression.TRUE_LEAF]
+    if len(domains) == 1:
+        return domains[0]
+    return expression.AND(domains)
+
+
+def _OR(domains):
+    """ Same as :func:`~odoo.osv.expression.OR` for normalized domains, but
+    returns the domain itself when there is only one.
+    """
+    if not domains:
+        return [expression.FALSE_LEAF]
+    if len(domains) == 1:
+        return domains[0]
+    return expression.OR(domains)
+
+
 class IrRule(models.Model):
     _name = 'ir.rule'
     _description = 'Record Rule'
@@ -66,9 +162,52 @@ class IrRule(models.Model):
     @api.constrains('model_id')
     def _check_model_name(self):
         # Don't allow rules on rules records (this model).
-        if any(rule.model_id.model == self._name for rule in self):
+        model_ids = tuple(self.mapped('model_id').ids)
+        if not model_ids:
+            return
+        self._cr.execute("SELECT 1 FROM ir_model WHERE id IN %s AND model=%s LIMIT 1", (model_ids, self._name))
+        if self._cr.fetchone():
             raise ValidationError(_('Rules can not be applied on the Record Rules model.'))
 
+    @tools.ormcache('rule_id', 'version')
+    def _fast_domain(self, rule_id, version, domain_force):
+        """ Return the template of the domain ``domain_force`` of the rule
+        ``rule_id`` if it can be evaluated without safe_eval, or ``None``
+        (see :func:`_parse_fast_domain`).
+        """
+        return _parse_fast_domain(domain_force)
+
+    def _fast_eval_domain(self, eval_context):
+        """ Return the domain of the rule ``self`` evaluated in ``eval_context``
+        if it only combines constants and simple values of the context, such
+        as ``[('company_id', 'in', company_ids)]``, or ``None``.
+        """
+        template = self._fast_domain(self.id, self.write_date, self.domain_force)
+        if template is None:
+            return None
+        domain = []
+        for value, name in template:
+            if name is not None:
+                names = name.split('.')
+                arg = eval_context[names[0]]
+                for attr in names[1:]:
+                    arg = getattr(arg, attr)
+                value = value + ([arg] if isinstance(value, list) else (arg,))
+            elif not isinstance(value, str):
+                # the template is cached, do not share its values
+                value = copy.deepcopy(value)
+            domain.append(value)
+        return domain
+
+    def _eval_domain(self, eval_context):
+        """ Return the domain of the rule ``self`` evaluated in ``eval_context``. """
+        if not self.domain_force:
+            return []
+        domain = self._fast_eval_domain(eval_context)
+        if domain is not None:
+            return domain
+        return safe_eval_cached(self.domain_force, eval_context)
+
     def _compute_domain_keys(self):
         """ Return the list of context keys to use for caching ``_compute_domain``. """
         return ['allowed_company_ids']
@@ -82,30 +221,54 @@ class IrRule(models.Model):
         rules get AND-ed and can each fail)
         """
         Model = for_records.browse(()).sudo()
+        ids = for_records.ids
+        if not ids:
+            return self.browse(())
         eval_context = self._eval_context()
 
         all_rules = self._get_rules(Model._name, mode=mode).sudo()
 
+        # evaluate the domain of every rule once
+        dom_by_rule = {
+            r.id: expression.normalize_domain(r._eval_domain(eval_context))
+            for r in all_rules
+        }
+
         # first check if the group rules fail for any record (aka if
         # searching on (records, group_rules) filters out some of the records)
-        group_rules = all_rules.filtered(lambda r: r.groups and r.groups & self.env.user.groups_id)
-        group_domains = expression.OR([
-            safe_eval(r.domain_force, eval_context) if r.domain_force else []
-            for r in group_rules
-        ])
-        # if all records get returned, the group rules are not failing
-        if Model.search_count(expression.AND([[('id', 'in', for_records.ids)], group_domains])) == len(for_records):
-            group_rules = self.browse(())
-
-        # failing rules are previously selected group rules or any failing global rule
-        def is_failing(r, ids=for_records.ids):
-            dom = safe_eval(r.domain_force, eval_context) if r.domain_force else []
-            return Model.search_count(expression.AND([
-                [('id', 'in', ids)],
-                expression.normalize_domain(dom)
-            ])) < len(ids)
-
-        return all_rules.filtered(lambda r: r in group_rules or (not r.groups and is_failing(r))).with_user(self.env.user)
+        user_group_ids = frozenset(self.env.user.groups_id.ids)
+        group_rules = all_rules.filtered(lambda r: r.groups and not user_group_ids.isdisjoint(r.groups.ids))
+        if group_rules:
+            group_domains = _OR([dom_by_rule[r.id] for r in group_rules])
+            dom = _AND([[('id', 'in', ids)], group_domains])
+            Model._flush_search(dom)
+            query_str, query_params = Model._where_calc(dom, active_test=False).select()
+            self._cr.execute(query_str, query_params)
+            # if all records get returned, the group rules are not failing
+            if {row[0] for row in self._cr.fetchall()}.issuperset(ids):
+                group_rules = self.browse(())
+
+        # failing rules are previously selected group rules or any failing
+        # global rule; a global rule fails as soon as one of the records is not
+        # matched by its domain, which is checked for all of them in one query
+        subqueries = []
+        params = []
+        for rule in all_rules.filtered(lambda r: not r.groups):
+            dom = _AND([[('id', 'in', ids)], dom_by_rule[rule.id]])
+            Model._flush_search(dom)
+            query_str, query_params = Model._where_calc(dom, active_test=False).subselect()
+            subqueries.append(
+                'SELECT %s AS rid WHERE EXISTS (SELECT 1 FROM unnest(%s) AS v(id)'
+                ' WHERE NOT EXISTS (SELECT 1 FROM ({}) s WHERE s.id = v.id))'.format(query_str)
+            )
+            params += [rule.id, ids] + query_params
+
+        failing_ids = set(group_rules.ids)
+        if subqueries:
+            self._cr.execute(' UNION ALL '.join(subqueries), params)
+            failing_ids.update(row[0] for row in self._cr.fetchall())
+
+        return all_rules.filtered(lambda r: r.id in failing_ids).with_user(self.env.user)
 
     def _get_rules(self, model_name, mode='read'):
         """ Returns all the rules matching the model for the mode for the
@@ -117,24 +280,19 @@ class IrRule(models.Model):
         if self.env.su and self.env.context.get("bypass_global_rules"):
             return self.browse(())
 
-        query = """ SELECT r.id FROM ir_rule r JOIN ir_model m ON (r.model_id=m.id)
-                    WHERE m.model=%s AND r.active AND r.perm_{mode}
-                    AND (r.id IN (SELECT rule_group_id FROM rule_group_rel rg
-                                  JOIN res_groups_users_rel gu ON (rg.group_id=gu.gid)
-                                  WHERE gu.uid=%s)
-                         OR r.global)
-                    ORDER BY r.id
-                """.format(mode=mode)
-
-        if self.env.su:
-            query = """ SELECT r.id FROM ir_rule r JOIN ir_model m ON (r.model_id=m.id)
-                        WHERE m.model=%s AND r.active AND r.perm_{mode}
-                        AND r.global
-                        ORDER BY r.id
-                        -- %s
-                    """.format(mode=mode)
-        self._cr.execute(query, (model_name, self._uid))
-        return self.browse(row[0] for row in self._cr.fetchall())
+        return self.browse(self._get_rule_ids(model_name, mode))
+
+    @tools.conditional(
+        'xml' not in config['dev_mode'],
+        tools.ormcache('self._uid', 'bool(self.env.su)', 'model_name', 'mode'),
+    )
+    def _get_rule_ids(self, model_name, mode):
+        """ Returns the ids of the rules matching the model for the mode for
+        the current user, as a tuple.
+        """
+        query = _RULES_SQL[(bool(self.env.su), mode)]
+        self._cr.execute(query, {'model': model_name, 'uid': self._uid})
+        return tuple([row[0] for row in self._cr.fetchall()])
 
     @api.model
     @tools.conditional(
@@ -149,22 +307,28 @@ class IrRule(models.Model):
 
         # browse user and rules as SUPERUSER_ID to avoid access errors!
         eval_context = self._eval_context()
-        user_groups = self.sudo(bypass_global_rules=True).env.user.groups_id
+        user_group_ids = frozenset(self.sudo(bypass_global_rules=True).env.user.groups_id.ids)
         global_domains = []                     # list of domains
         group_domains = []                      # list of domains
+        has_domain = False
         for rule in rules.sudo():
             # evaluate the domain for the current user
-            dom = safe_eval(rule.domain_force, eval_context) if rule.domain_force else []
-            dom = expression.normalize_domain(dom)
+            dom = rule._eval_domain(eval_context)
+            has_domain = has_domain or bool(dom)
+            dom = expression.normalize_domain(dom) if dom else [expression.TRUE_LEAF]
             if not rule.groups:
                 global_domains.append(dom)
-            elif rule.groups & user_groups:
+            elif not user_group_ids.isdisjoint(rule.groups.ids):
                 group_domains.append(dom)
 
+        # no restriction at all: only unrestricted global rules apply
+        if not group_domains and not has_domain:
+            return
+
         # combine global domains and group domains
         if not group_domains:
-            return expression.AND(global_domains)
-        return expression.AND(global_domains + [expression.OR(group_domains)])
+            return _AND(global_domains)
+        return _AND(global_domains + [_OR(group_domains)])
 
     def _compute_domain_context_values(self):
         for k in self._compute_domain_keys():
@@ -219,8 +383,12 @@ class IrRule(models.Model):
         # - odoo/addons/test_access_rights/tests/test_feedback.py
         # - odoo/addons/test_access_rights/tests/test_ir_rules.py
         # - odoo/addons/base/tests/test_orm.py (/home/dle/src/odoo/master-nochange-fp/odoo/addons/base/tests/test_orm.py)
-        self.flush()
-        self.clear_caches()
+        # only the fields that determine the rules of a user and their domain
+        # invalidate the caches
+        if vals.keys() & {'model_id', 'groups', 'domain_force', 'active',
+                          'perm_read', 'perm_write', 'perm_create', 'perm_unlink'}:
+            self.flush()
+            self.clear_caches()
         return res
 
     def _make_access_error(self, operation, records):
@@ -255,7 +423,11 @@ class IrRule(models.Model):
         rules = self._get_failing(records, mode=operation).sudo()
 
         # APPSTOGROW: Max privileges are needed to avoid a loop.
-        records_description = ', '.join(['%s (id=%s)' % (rec.display_name, rec.id) for rec in records[:6].sudo_bypass_global_rules()])
+        records_sudo = records[:6].sudo_bypass_global_rules()
+        records_description = ', '.join([
+            '%s (id=%s)' % (name, rec.id)
+            for name, rec in zip(records_sudo.mapped('display_name'), records_sudo)
+        ])
         failing_records = _("Records: %s", records_description)
 
         user_description = '%s (id=%s)' % (self.env.user.name, self.env.user.id)
@@ -7,7 +7,7 @@ from odoo import SUPERUSER_ID
 from odoo.exceptions import UserError, ValidationError
 from odoo.tests.common import TransactionCase, BaseCase
 from odoo.tools import mute_logger
-from odoo.tools.safe_eval import safe_eval, const_eval, expr_eval
+from odoo.tools.safe_eval import safe_eval, safe_eval_cached, const_eval, expr_eval
 
 
 class TestSafeEval(BaseCase):
@@ -60,6 +60,27 @@ class TestSafeEval(BaseCase):
         with self.assertRaises(NameError):
             safe_eval("self.__name__", {'self': self}, mode="exec")
 
+    @mute_logger('odoo.tools.safe_eval')
+    def test_06_safe_eval_cached(self):
+        """ Cached evaluation behaves like safe_eval """
+        expr = "[('id', 'in', ids)]"
+        self.assertEqual(safe_eval_cached(expr, {'ids': [1, 2]}), safe_eval(expr, {'ids': [1, 2]}))
+        self.assertEqual(safe_eval_cached(expr, {'ids': [3]}), [('id', 'in', [3])])
+
+        # errors are reported with the expression
+        with self.assertRaisesRegex(ValueError, "ids"):
+            safe_eval_cached(expr, {})
+
+        # no raw module in the evaluation context
+        with self.assertRaises(TypeError):
+            safe_eval_cached(expr, {'ids': ast})
+
+        # no code object, nor forbidden expression
+        with self.assertRaises(TypeError):
+            safe_eval_cached(compile(expr, "", "eval"), {'ids': [1]})
+        with self.assertRaises(ValueError):
+            safe_eval_cached('open("/etc/passwd","r")')
+
 
 # samples use effective TLDs from the Mozilla public suffix
 # list at http://publicsuffix.org
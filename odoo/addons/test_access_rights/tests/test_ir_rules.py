@@ -1,9 +1,10 @@
 # -*- coding: utf-8 -*-
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
-from odoo.exceptions import AccessError
+from odoo.exceptions import AccessError, ValidationError
 from odoo.tests.common import TransactionCase
 from odoo.tools import mute_logger
+from odoo.tools.safe_eval import safe_eval
 
 
 class TestRules(TransactionCase):
@@ -96,6 +97,108 @@ class TestRules(TransactionCase):
         container_admin.invalidate_cache(['some_ids'])
         self.assertItemsEqual(container_admin.some_ids.ids, [])
 
+    def test_get_failing(self):
+        """ Only the global rules filtering out some records are failing. """
+        env = self.env(user=self.browse_ref('base.public_user'))
+        records = env['test_access_right.some_obj'].browse([self.id1, self.id2])
+
+        failing = env['ir.rule']._get_failing(records)
+        self.assertEqual(failing.sudo().mapped('name'), ['Forbid negatives'])
+        self.assertFalse(env['ir.rule']._get_failing(records[0]))
+        self.assertFalse(env['ir.rule']._get_failing(records.browse()))
+
+    def test_empty_global_rule(self):
+        """ Global rules without domain do not restrict anything. """
+        self.env['ir.rule'].create({
+            'name': 'All categories',
+            'model_id': self.browse_ref('test_access_rights.model_test_access_right_obj_categ').id,
+        })
+        env = self.env(user=self.browse_ref('base.public_user'))
+        self.assertFalse(env['ir.rule']._compute_domain('test_access_right.obj_categ'))
+
+    def test_get_rules_invalidation(self):
+        """ The rules of a user follow the changes of their groups and of the rules. """
+        model_name = 'test_access_right.some_obj'
+        group = self.browse_ref('test_access_rights.test_group')
+        rule = self.env['ir.rule'].create({
+            'name': 'Test group rule',
+            'model_id': self.browse_ref('test_access_rights.model_test_access_right_some_obj').id,
+            'groups': [(6, 0, [group.id])],
+            'domain_force': "[('val', '>', 1)]",
+        })
+        user = self.env['res.users'].create({
+            'name': 'Rule User',
+            'login': 'rule_user',
+            'groups_id': [(6, 0, [self.ref('base.group_user')])],
+        })
+        Rule = self.env['ir.rule'].with_user(user)
+        self.assertNotIn(rule.id, Rule._get_rules(model_name).ids)
+
+        user.write({'groups_id': [(4, group.id)]})
+        self.assertIn(rule.id, Rule._get_rules(model_name).ids)
+
+        rule.active = False
+        self.assertNotIn(rule.id, Rule._get_rules(model_name).ids)
+
+        rule.active = True
+        self.assertIn(rule.id, Rule._get_rules(model_name).ids)
+
+    def test_no_rule_on_rules(self):
+        """ Rules cannot be applied on the rules themselves. """
+        with self.assertRaises(ValidationError):
+            self.env['ir.rule'].create({
+                'name': 'Rule on rules',
+                'model_id': self.env['ir.model']._get('ir.rule').id,
+            })
+
+    def test_compute_domain_invalidation(self):
+        """ Writing the fields of a rule that affect access invalidates the
+        domain of its model, writing other fields does not. """
+        model_name = 'test_access_right.some_obj'
+        Rule = self.env['ir.rule'].with_user(self.browse_ref('base.public_user'))
+        rule = self.env['ir.rule'].search([('name', '=', 'Forbid negatives')])
+        self.assertIn(('val', '>', 0), Rule._compute_domain(model_name))
+
+        rule.domain_force = "[('val', '>', 1)]"
+        domain = Rule._compute_domain(model_name)
+        self.assertIn(('val', '>', 1), domain)
+        self.assertNotIn(('val', '>', 0), domain)
+
+        rule.active = False
+        self.assertNotIn(('val', '>', 1), Rule._compute_domain(model_name))
+
+        rule.active = True
+        domain = Rule._compute_domain(model_name)
+        rule.name = 'Forbid small values'
+        with self.assertQueryCount(0):
+            self.assertEqual(Rule._compute_domain(model_name), domain)
+
+    def test_fast_eval_domain(self):
+        """ Simple domains are evaluated like safe_eval() would, other ones are not. """
+        Rule = self.env['ir.rule']
+        model_id = self.browse_ref('test_access_rights.model_test_access_right_some_obj').id
+        eval_context = Rule._eval_context()
+
+        for domain_force in [
+            "['|', ('company_id', '=', False), ('company_id', 'in', company_ids)]",
+            "[('company_id', '=', company_id)]",
+            "[('create_uid', '=', user.id)]",
+            "[('create_uid.partner_id', '=', user.partner_id.id)]",
+            "[['create_uid', '=', user.id]]",
+        ]:
+            rule = Rule.create({'name': 'Fast', 'model_id': model_id, 'domain_force': domain_force, 'active': False})
+            self.assertEqual(rule._fast_eval_domain(eval_context), safe_eval(domain_force, eval_context))
+
+        for domain_force in [
+            "[('company_id', '=', user.company_id.id)]",
+            "[('create_date', '<', time.strftime('%Y-%m-%d'))]",
+        ]:
+            rule = Rule.create({'name': 'Slow', 'model_id': model_id, 'domain_force': domain_force, 'active': False})
+            self.assertIsNone(rule._fast_eval_domain(eval_context))
+
+        rule = Rule.search([('name', '=', 'See all categories')])
+        self.assertIsNone(rule._fast_eval_domain(eval_context))
+
     def test_access_rule_performance(self):
         env = self.env(user=self.browse_ref('base.public_user'))
         Model = env['test_access_right.some_obj']
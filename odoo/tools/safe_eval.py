@@ -30,7 +30,7 @@ import odoo
 
 unsafe_eval = eval
 
-__all__ = ['test_expr', 'safe_eval', 'const_eval']
+__all__ = ['test_expr', 'safe_eval', 'safe_eval_cached', 'const_eval']
 
 # The time module is usually already provided in the safe_eval environment
 # but some code, e.g. datetime.datetime.now() (Windows/Python 2.5.2, bug
@@ -359,6 +359,31 @@ def safe_eval(expr, globals_dict=None, locals_dict=None, mode="eval", nocopy=Fal
                 count_unsafe = count_total - count_safe
                 if count_unsafe:
                     raise odoo.exceptions.UserError('safe_eval: The code cannot have this phrase:  {}'.format(text))
+    return _eval_code(c, globals_dict, locals_dict, expr)
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile_eval(expr):
+    """ Return the checked code object of the expression ``expr``. """
+    return test_expr(expr, _SAFE_OPCODES, mode="eval")
+
+
+def safe_eval_cached(expr, globals_dict=None):
+    """safe_eval_cached(expression[, globals]) -> result
+
+    Same as ``safe_eval(expr, globals_dict)``, except that the checked code
+    of the expression is kept in a cache, so that expressions evaluated over
+    and over (like record rule domains) are only compiled once.
+    """
+    if type(expr) is CodeType:
+        raise TypeError("safe_eval does not allow direct evaluation of code objects.")
+    globals_dict = dict(globals_dict or {})
+    check_values(globals_dict)
+    globals_dict['__builtins__'] = _BUILTINS
+    return _eval_code(_compile_eval(expr), globals_dict, None, expr)
+
+
+def _eval_code(c, globals_dict, locals_dict, expr):
     try:
         return unsafe_eval(c, globals_dict, locals_dict)
     except odoo.exceptions.UserError: